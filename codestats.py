@@ -2,21 +2,17 @@ import enum
 import os
 import subprocess
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from fnmatch import fnmatch
+from functools import partial
 import logging
 
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 import re
 
 logging.basicConfig(level=logging.INFO)
 
 
-class MultileCommentToken(enum.Enum):
-    START = enum.auto()
-    END = enum.auto()
-    NONE = enum.auto()
-
-
 class Language(enum.Enum):
     UNKOWN = "unknown"
     TYPESCRIPT = "TypeScript"
@@ -187,70 +183,91 @@ class FolderReport:
         print(self.make_printable_row(total_row, col_widths))
 
 
+_BASENAME_TO_LANG: Dict[str, Language] = {
+    'CMakeLists.txt': Language.CMAKE,
+    'Dockerfile': Language.DOCKER,
+    'Jenkinsfile': Language.JENKINS,
+}
+
+_EXT_TO_LANG: Dict[str, Language] = {
+    '.ts': Language.TYPESCRIPT,
+    '.c': Language.C,
+    '.h': Language.C,
+    '.cpp': Language.CPP,
+    '.hpp': Language.CPP,
+    '.py': Language.PYTHON,
+    '.pyi': Language.PYTHON,
+    '.js': Language.JAVASCRIPT,
+    '.cjs': Language.JAVASCRIPT,
+    '.html': Language.HTML,
+    '.htm': Language.HTML,
+    '.md': Language.MARKDOWN,
+    '.json': Language.JSON,
+    '.sh': Language.BASH,
+    '.bash': Language.BASH,
+    '.css': Language.CSS,
+    '.cmake': Language.CMAKE,
+    '.bat': Language.BATCHFILE,
+}
+
+
 def get_language(filename: str, metadata: FolderMetadata) -> Language:
-    ext = os.path.splitext(filename)[1].strip().lower()
-    basename = os.path.basename(filename)
-    if basename == 'CMakeLists.txt':
-        return Language.CMAKE
-
-    if basename == 'Dockerfile':
-        return Language.DOCKER
-    if basename == 'Jenkinsfile':
-        return Language.JENKINS
-
-    if ext in ['.ts']:
-        return Language.TYPESCRIPT
-    if ext in ['.c', '.h']:
-        return Language.C
-    if ext in ['.cpp', '.hpp']:
-        return Language.CPP
-    if ext in ['.py', '.pyi']:
-        return Language.PYTHON
-    if ext in ['.js', '.cjs']:
-        return Language.JAVASCRIPT
-    if ext in ['.html', '.htm']:
-        return Language.HTML
-    if ext in ['.md']:
-        return Language.MARKDOWN
-    if ext in ['.json']:
-        return Language.JSON
-    if ext in ['.sh', '.bash']:
-        return Language.BASH
-    if ext in ['.css']:
-        return Language.CSS
-    if ext in ['.cmake']:
-        return Language.CMAKE
-    if ext in ['.bat']:
-        return Language.BATCHFILE
-
-    raise Exception('Unknown language for file %s' % filename)
-
-
-def get_line_type(line: str, lang: Language, in_comment: bool = False) -> LineType:
+    lang = _BASENAME_TO_LANG.get(os.path.basename(filename))
+    if lang is None:
+        ext = os.path.splitext(filename)[1].strip().lower()
+        lang = _EXT_TO_LANG.get(ext)
+
+    if lang is None:
+        raise Exception('Unknown language for file %s' % filename)
+
+    return lang
+
+
+def classify_line(line: str, lang: Language, in_comment: bool) -> Tuple[bool, LineType]:
+    # Single pass per line: update the multiline-comment state and classify
+    # the line in one call instead of scanning it twice.
+    if lang in [Language.C, Language.CPP, Language.CSS, Language.JAVASCRIPT, Language.TYPESCRIPT, Language.JENKINS]:
+        start = line.rfind('/*')
+        end = line.rfind('*/')
+
+        if end == -1:
+            if start != -1:
+                in_comment = True
+        else:
+            if start == -1:
+                in_comment = False
+            elif start > end:
+                in_comment = True
+    elif lang in [Language.PYTHON]:
+        # An odd number of triple quotes toggles the docstring state; an even
+        # number leaves it unchanged.
+        if line.count('"""') % 2 == 1:
+            in_comment = not in_comment
+
     line = line.strip()
     if not line:
-        return LineType.BLANK
-    if in_comment:  # Todo : handle multiline comments
-        return LineType.COMMENT
+        return in_comment, LineType.BLANK
+    if in_comment:
+        return in_comment, LineType.COMMENT
 
+    # Prefix/suffix tests on the stripped line are several times cheaper than
+    # running the regex engine and this is called for every line of the repo.
     if lang in [Language.C, Language.CPP, Language.TYPESCRIPT, Language.JAVASCRIPT, Language.JENKINS]:
-        comment_regex = re.compile('^\s*(\/\/.+)|(\/\*.*\*\/)\s*$')
-        if comment_regex.match(line):
-            return LineType.COMMENT
+        if line.startswith('//') and len(line) > 2:
+            return in_comment, LineType.COMMENT
+        if line.startswith('/*') and line.endswith('*/') and len(line) >= 4:
+            return in_comment, LineType.COMMENT
     elif lang in [Language.PYTHON, Language.CMAKE, Language.BASH, Language.DOCKER]:
-        comment_regex = re.compile('^\s*#.+\s*$')
-        if comment_regex.match(line):
-            return LineType.COMMENT
+        if line.startswith('#') and len(line) > 1:
+            return in_comment, LineType.COMMENT
     elif lang in [Language.CSS]:
-        comment_regex = re.compile('^\s*(\/\*.*\*\/)\s*$')
-        if comment_regex.match(line):
-            return LineType.COMMENT
+        if line.startswith('/*') and line.endswith('*/') and len(line) >= 4:
+            return in_comment, LineType.COMMENT
     elif lang in [Language.HTML]:
-        comment_regex = re.compile('^\s*<!--.*-->\s*$')
-        if comment_regex.match(line):
-            return LineType.COMMENT
+        if line.startswith('<!--') and line.endswith('-->') and len(line) >= 7:
+            return in_comment, LineType.COMMENT
 
-    return LineType.CODE
+    return in_comment, LineType.CODE
 
 
 def get_file_type(filename: str, lang: Language, metadata: FolderMetadata) -> FileType:
@@ -275,38 +292,6 @@ def get_file_type(filename: str, lang: Language, metadata: FolderMetadata) -> Fi
     return FileType.CODE
 
 
-def check_multiline_comment_token(line: str, lang: Language, in_comment: bool) -> MultileCommentToken:
-    if lang in [Language.C, Language.CPP, Language.CSS, Language.JAVASCRIPT, Language.TYPESCRIPT, Language.JENKINS]:
-        start = line.rfind('/*')
-        end = line.rfind('*/')
-
-        if end == -1:
-            if start != -1:
-                return MultileCommentToken.START
-        else:
-            if start == -1:
-                return MultileCommentToken.END
-            if start > end:
-                return MultileCommentToken.START
-
-    if lang in [Language.PYTHON]:
-        token_count = 0  # todo
-        search = -3
-        while True:
-            search = line.find('"""', search + 3)
-            if search == -1:
-                break
-            token_count += 1
-
-        if token_count > 0:
-            if token_count % 2 == 0:
-                return MultileCommentToken.START if in_comment else MultileCommentToken.END
-            else:
-                return MultileCommentToken.END if in_comment else MultileCommentToken.START
-
-    return MultileCommentToken.NONE
-
-
 def read_metadata(folder: str) -> FolderMetadata:
     return FolderMetadata()  # todo
 
@@ -317,43 +302,60 @@ def scan_folder(folder: str) -> FolderReport:
 
     metadata = read_metadata(folder)
 
-    os.chdir(folder)
-    cmd_output = subprocess.check_output(['git', 'ls-tree', '--full-tree', '-r', '--name-only', 'HEAD'])
+    # No os.chdir: mutating process-wide state breaks reentrancy. Run git in
+    # the folder instead and join the relative names it returns.
+    cmd_output = subprocess.check_output(['git', 'ls-tree', '--full-tree', '-r', '--name-only', 'HEAD'], cwd=folder)
     file_list = sorted([file.strip() for file in cmd_output.decode('utf8').split('\n') if file])
     report = FolderReport()
 
+    # Excluded files are filtered here, before any worker opens them.
+    work_list = []
     for filename in file_list:
-        try:
-            report.files[filename] = scan_file(filename, metadata)
-        except Exception as e:
-            logging.debug('Skipping %s: %s' % (filename, e))
+        excluded = False
+        for exclude_pattern in metadata.exclude_patterns:
+            if fnmatch(filename, exclude_pattern):
+                excluded = True
+                break
+
+        if excluded:
+            logging.debug('Skipping %s: excluded' % filename)
             report.skipped.append(filename)
+        else:
+            work_list.append(filename)
+
+    # Classification is CPU-bound and independent per file, so spread it
+    # across cores. _scan_one traps per-file errors so one unreadable file
+    # cannot take the whole pool down.
+    with ProcessPoolExecutor() as executor:
+        for filename, file_report, error in executor.map(partial(_scan_one, folder=folder, metadata=metadata), work_list, chunksize=32):
+            if file_report is None:
+                logging.debug('Skipping %s: %s' % (filename, error))
+                report.skipped.append(filename)
+            else:
+                report.files[filename] = file_report
 
     return report
 
 
-def scan_file(filename: str, metadata: FolderMetadata) -> FileReport:
-    if not os.path.isfile(filename):
-        raise Exception('%s is not a file' % (filename))
+def _scan_one(filename: str, folder: str, metadata: FolderMetadata) -> Tuple[str, Optional[FileReport], str]:
+    try:
+        return filename, scan_file(os.path.join(folder, filename), metadata), ''
+    except Exception as e:
+        return filename, None, str(e)
 
-    for exclude_pattern in metadata.exclude_patterns:
-        if fnmatch(filename, exclude_pattern):
-            raise Exception("Excluded")
 
+def scan_file(filename: str, metadata: FolderMetadata) -> FileReport:
+    # No isfile pre-check: the caller got the name from git, and
+    # get_file_type still rejects anything that is not a regular file.
     report = FileReport()
     report.language = get_language(filename, metadata)
     report.file_type = get_file_type(filename, report.language, metadata)
 
     with open(filename, 'r') as f:
         in_comment = False
-        for line in f.readlines():
-            multiline_comment_token = check_multiline_comment_token(line, report.language, in_comment)
-            if multiline_comment_token == MultileCommentToken.START:
-                in_comment = True
-            elif multiline_comment_token == MultileCommentToken.END:
-                in_comment = False
-
-            report.lines[get_line_type(line, report.language, in_comment)] += 1
+        for line in f:
+            in_comment, line_type = classify_line(line, report.language, in_comment)
+            report.lines[line_type] += 1
 
     return report
 